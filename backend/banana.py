@@ -1,41 +1,334 @@
-import mimetypes
+import hashlib
+import io
+import itertools
 import os
-import json
+import logging
+import queue
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from typing import List
+import httpx
 from google import genai
-from google.genai import types
-from pydantic import BaseModel
+from google.genai import errors, types
+from PIL import Image, ImageOps
+from pydantic import BaseModel, Field, ValidationError
+from tenacity import retry, retry_if_exception, stop_after_attempt, wait_random_exponential
 
 from dotenv import load_dotenv
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+# Folder paths relative to the script location
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+APPARELS_DIR = os.path.join(SCRIPT_DIR, "apparels")
+MODEL_DIR = os.path.join(SCRIPT_DIR, "model")
+
+# Gemini rejects requests over 20 MB and inline images go out base64-encoded
+# (4/3 larger), so the raw image bytes in one request stay under this budget
+MAX_REQUEST_IMAGE_BYTES = 12 << 20
+
+# Raw files can be much larger since they're downscaled before sending;
+# this only guards against reading absurdly large files into memory
+MAX_IMAGE_FILE_BYTES = 64 << 20
+
+# Longest side images are downscaled to before upload; Gemini doesn't need more
+MAX_IMAGE_SIDE = 1536
+
+# Inline image types Gemini accepts; other formats we read (GIF, BMP) are re-encoded
+GEMINI_IMAGE_TYPES = frozenset({"image/png", "image/jpeg", "image/webp"})
+
+ANALYSIS_MODEL = "gemini-2.5-flash"
+GENERATION_MODEL = "gemini-2.5-flash-image-preview"
+
+# Prompts are fixed strings placed ahead of the images in every request, so
+# the identical prefix is eligible for Gemini's implicit context caching.
+# The output shape comes from the response schema, so the analysis prompts don't spell it out.
+ANALYSIS_PROMPT = """Analyze this clothing item image and provide detailed information about it.
+
+    Focus on visible characteristics and provide specific, descriptive tags that would be useful for fashion categorization and search."""
+
+BATCH_ANALYSIS_PROMPT = """Analyze each of the clothing item images below and provide detailed information about each one.
+
+    Return exactly one entry per image, in the same order as the images are numbered.
+    Focus on visible characteristics and provide specific, descriptive tags that would be useful for fashion categorization and search."""
+
+PRODUCT_SHOOT_PROMPT = """Using the provided images, place [apparel items from the apparel images] onto [model from the model image].
+    Ensure that the features of [model from the model image] remain completely unchanged. The added [apparel items] should integrate naturally and realistically, with proper layering and positioning appropriate for each type of item (clothing, accessories, shoes, etc.).
+
+    Generate a single composite image that shows the model wearing the clothing from 4 different angles:
+    1. Front view - model facing forward
+    2. Back view - model facing away
+    3. Side view (left profile)
+    4. Side view (right profile)
+
+    Arrange these 4 views in a clean, professional grid layout suitable for an e-commerce product listing.
+    The background should be clean and neutral (white or light gray).
+    Ensure the clothing fits naturally on the model and maintain consistent lighting across all angles.
+    The style should be professional fashion photography suitable for online retail.
+
+    Important: Only follow the exact appearance and characteristics shown in the provided images - do not add any additional features or modifications."""
+
+# HTTP statuses worth retrying besides 5xx: request timeout and rate limiting
+RETRYABLE_STATUS_CODES = frozenset({408, 429})
+
+# Errors a Gemini request can end with once retries are exhausted
+ANALYSIS_REQUEST_ERRORS = (errors.APIError, httpx.HTTPError)
+
+# Upper bounds on concurrent Gemini analysis requests and image file reads
+MAX_ANALYSIS_WORKERS = 10
+MAX_LOAD_WORKERS = 8
+
+# Most images sent in a single batched analysis request
+ANALYSIS_BATCH_SIZE = 8
+
+IMAGE_EXTENSIONS = frozenset({'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp'})
+
+# Fixed lookup instead of the mimetypes database for naming generated images
+MIME_TO_EXTENSION = {
+    'image/jpeg': '.jpg',
+    'image/png': '.png',
+    'image/gif': '.gif',
+    'image/bmp': '.bmp',
+    'image/webp': '.webp',
+}
+
 class ClothingAnalysis(BaseModel):
     """Structured output for clothing item analysis."""
-    description: str
-    tags: List[str]
-    clothing_type: str
-    color: str
-    texture: str
-    material: str
-    style: str
-    season: str
+    description: str = Field(description="A detailed description of the clothing item")
+    tags: List[str] = Field(description="Relevant tags about the item's characteristics")
+    clothing_type: str = Field(description="Type of clothing (e.g., shirt, pants, dress, hat, etc.)")
+    color: str = Field(description="Primary color of the item")
+    texture: str = Field(description="Texture description (e.g., smooth, rough, knitted, woven)")
+    material: str = Field(description="Material type (e.g., cotton, wool, denim, leather)")
+    style: str = Field(description="Style description (e.g., casual, formal, vintage, modern)")
+    season: str = Field(description="Suitable season (e.g., summer, winter, all-season)")
+
+# Fallback returned when a response can't be parsed; built once and shared, so treat it as read-only
+_UNKNOWN_ANALYSIS = ClothingAnalysis(
+    description="Unable to analyze clothing item",
+    tags=["unknown"],
+    clothing_type="unknown",
+    color="unknown",
+    texture="unknown",
+    material="unknown",
+    style="unknown",
+    season="unknown"
+)
+
+# Analyses are cached by SHA-256 of the image bytes (plus model and cache
+# version): an in-process LRU in front of one JSON file per image so
+# unchanged images skip Gemini across runs
+ANALYSIS_CACHE_SIZE = 1024
+# Bump when ANALYSIS_PROMPT or the ClothingAnalysis fields change so old entries stop matching
+ANALYSIS_CACHE_VERSION = 1
+ANALYSIS_CACHE_DIR = os.path.join(SCRIPT_DIR, ".analysis_cache")
+_analysis_cache = OrderedDict()
+_analysis_cache_lock = threading.Lock()
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_client():
+    """Return the shared Gemini client, creating it on first use."""
+    global _client
+    # Locked so concurrent first calls from worker threads build only one client
+    with _client_lock:
+        if _client is None:
+            _client = genai.Client(
+                api_key=os.environ.get("GEMINI_API_KEY"),
+            )
+        return _client
+
+def _is_retryable(exception):
+    """Retry connection failures, rate limits, timeouts and server-side errors; other API errors are terminal."""
+    # Timeouts, dropped connections and broken responses are transient; proxy or
+    # protocol misconfiguration (also TransportErrors) won't fix itself on retry
+    if isinstance(exception, (httpx.TimeoutException, httpx.NetworkError, httpx.RemoteProtocolError)):
+        return True
+    if not isinstance(exception, errors.APIError):
+        return False
+    return exception.code in RETRYABLE_STATUS_CODES or (exception.code or 0) >= 500
+
+# Jittered exponential backoff so concurrent workers don't retry in lockstep
+_retry_transient_errors = retry(
+    retry=retry_if_exception(_is_retryable),
+    wait=wait_random_exponential(min=1, max=30),
+    stop=stop_after_attempt(5),
+    reraise=True,
+)
+
+@_retry_transient_errors
+def _generate_content(**kwargs):
+    """Call generate_content on the shared client, retrying transient failures."""
+    return get_client().models.generate_content(**kwargs)
+
+@_retry_transient_errors
+def _open_content_stream(**kwargs):
+    """
+    Start a generate_content_stream request, retrying transient failures.
+
+    Only getting the first chunk is retried; errors after that propagate so
+    images that were already saved aren't generated twice.
+    """
+    stream = get_client().models.generate_content_stream(**kwargs)
+    first_chunk = next(stream, None)
+    if first_chunk is None:
+        return iter(())
+    return itertools.chain([first_chunk], stream)
 
 def save_binary_file(file_name, data):
-    f = open(file_name, "wb")
-    f.write(data)
-    f.close()
-    print(f"File saved to: {file_name}")
+    # The data is already in memory, so skip Python's file object layer and
+    # write straight to the descriptor. os.write may be partial, hence the loop.
+    fd = os.open(file_name, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        view = memoryview(data)
+        while view:
+            view = view[os.write(fd, view):]
+    finally:
+        os.close(fd)
+    logger.debug("File saved to: %s", file_name)
+
+
+def _write_queued_files(write_queue, write_errors):
+    """Save (file_path, data) items from the queue until a None sentinel arrives."""
+    while (item := write_queue.get()) is not None:
+        file_path, data = item
+        try:
+            save_binary_file(file_path, data)
+        except OSError as e:
+            write_errors.append(e)
+
+
+def _sniff_image(head):
+    """Return the mime type implied by an image's leading bytes, or None if unrecognized."""
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if head.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    if head[:6] in (b"GIF87a", b"GIF89a"):
+        return "image/gif"
+    if head.startswith(b"BM"):
+        return "image/bmp"
+    return None
+
+def _read_image_file(image_path):
+    """Read an image file unmodified and return its bytes and sniffed mime type."""
+    with open(image_path, "rb") as image_file:
+        # The file's magic bytes decide the type, checked before reading the rest;
+        # a name that doesn't match its contents is rejected
+        head = image_file.read(32)
+        mime_type = _sniff_image(head)
+        if mime_type is None:
+            raise ValueError(f"Not a supported image file: {image_path}")
 
+        size = os.fstat(image_file.fileno()).st_size
+        if size > MAX_IMAGE_FILE_BYTES:
+            raise ValueError(f"Image file too large ({size} bytes, max {MAX_IMAGE_FILE_BYTES}): {image_path}")
+        image_data = head + image_file.read()
+
+    return image_data, mime_type
 
 def load_image_as_bytes(image_path):
     """Load an image file and return bytes data and mime type for the API."""
-    with open(image_path, "rb") as image_file:
-        image_data = image_file.read()
-        mime_type = mimetypes.guess_type(image_path)[0]
-        if mime_type is None:
-            mime_type = "image/jpeg"  # Default fallback
-        return image_data, mime_type
+    image_data, mime_type = _read_image_file(image_path)
+    return _fit_image_for_request(image_data, mime_type, image_path)
+
+def _fit_image_for_request(image_data, mime_type, source="image data"):
+    """Shrink an image for sending and check that it fits in a single request on its own."""
+    try:
+        image_data, mime_type = _shrink_image(image_data, mime_type)
+    except (OSError, SyntaxError, ValueError, Image.DecompressionBombError) as e:
+        # Pillow's errors don't say which image failed; source is usually the file path
+        raise ValueError(f"Cannot decode image: {source} ({e})") from e
+    if len(image_data) > MAX_REQUEST_IMAGE_BYTES:
+        raise ValueError(f"Image too large to send ({len(image_data)} bytes, max {MAX_REQUEST_IMAGE_BYTES}): {source}")
+    return image_data, mime_type
+
+def _shrink_image(image_data, mime_type):
+    """Re-encode images that are too large or in a format Gemini doesn't accept; others pass through untouched."""
+    with Image.open(io.BytesIO(image_data)) as image:
+        if max(image.size) <= MAX_IMAGE_SIDE and mime_type in GEMINI_IMAGE_TYPES:
+            return image_data, mime_type
+
+        # Let libjpeg decode at a reduced scale instead of full resolution
+        if image.format == "JPEG":
+            image.draft("RGB", (MAX_IMAGE_SIDE, MAX_IMAGE_SIDE))
+
+        # Re-encoding drops EXIF, so apply the camera's orientation first
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((MAX_IMAGE_SIDE, MAX_IMAGE_SIDE), Image.Resampling.LANCZOS)
+
+        buffer = io.BytesIO()
+        if image.mode in ("RGBA", "LA", "PA") or "transparency" in image.info:
+            # Keep transparent backgrounds; JPEG would flatten them to black
+            image.convert("RGBA").save(buffer, "PNG", optimize=True)
+            return buffer.getvalue(), "image/png"
+
+        image.convert("RGB").save(buffer, "JPEG", quality=85, optimize=True)
+        return buffer.getvalue(), "image/jpeg"
     
+def _analysis_cache_key(image_bytes):
+    """Return the analysis cache key for an image's original (not downscaled) bytes."""
+    # The model and cache version are part of the key, so changing either invalidates old analyses
+    digest = hashlib.sha256(f"{ANALYSIS_CACHE_VERSION}:{ANALYSIS_MODEL}:".encode())
+    digest.update(image_bytes)
+    return digest.hexdigest()
+
+def _remember_analysis(key, analysis):
+    """Store an analysis in memory, evicting the least recently used entry when full."""
+    with _analysis_cache_lock:
+        _analysis_cache[key] = analysis
+        _analysis_cache.move_to_end(key)
+        if len(_analysis_cache) > ANALYSIS_CACHE_SIZE:
+            _analysis_cache.popitem(last=False)
+
+def _get_cached_analysis(key):
+    """Return the cached analysis for an image hash from memory or disk, or None."""
+    with _analysis_cache_lock:
+        analysis = _analysis_cache.get(key)
+        if analysis is not None:
+            _analysis_cache.move_to_end(key)
+            return analysis
+
+    cache_path = os.path.join(ANALYSIS_CACHE_DIR, f"{key}.json")
+    try:
+        with open(cache_path, "rb") as cache_file:
+            analysis = ClothingAnalysis.model_validate_json(cache_file.read())
+    except FileNotFoundError:
+        return None
+    except (OSError, ValidationError) as e:
+        logger.warning("Ignoring unreadable analysis cache entry %s: %s", cache_path, e)
+        return None
+
+    _remember_analysis(key, analysis)
+    return analysis
+
+def _cache_analysis(key, analysis):
+    """Store an analysis in memory and persist it to the on-disk cache."""
+    _remember_analysis(key, analysis)
+
+    cache_path = os.path.join(ANALYSIS_CACHE_DIR, f"{key}.json")
+    # Write to a per-thread temp file and rename so readers never see a partial entry
+    tmp_path = f"{cache_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        os.makedirs(ANALYSIS_CACHE_DIR, exist_ok=True)
+        with open(tmp_path, "wb") as cache_file:
+            cache_file.write(analysis.model_dump_json().encode())
+        os.replace(tmp_path, cache_path)
+    except OSError as e:
+        logger.warning("Could not write analysis cache entry %s: %s", cache_path, e)
+
+def _bytes_to_part(data, mime_type):
+    """Wrap in-memory image bytes as a content part for the API."""
+    return types.Part.from_bytes(
+        data=data,
+        mime_type=mime_type
+    )
+
 def analyze_clothing_item(image_path):
     """
     Analyze a clothing item image and return structured information about it.
@@ -46,118 +339,213 @@ def analyze_clothing_item(image_path):
     Returns:
         ClothingAnalysis: Structured analysis of the clothing item
     """
-    client = genai.Client(
-        api_key=os.environ.get("GEMINI_API_KEY"),
-    )
+    image_bytes, mime_type = _read_image_file(image_path)
+    return analyze_clothing_item_bytes(image_bytes, mime_type)
 
-    # Load the clothing image
-    image_bytes, mime_type = load_image_as_bytes(image_path)
+def analyze_clothing_items(image_paths):
+    """
+    Analyze several clothing item images, batching them into as few Gemini calls as possible.
 
-    image = types.Part.from_bytes(
-        data=image_bytes,
-        mime_type=mime_type
-    )
+    Cached images are answered locally; the rest are sent several images per
+    request, with batches running concurrently. A failure only affects the
+    images it belongs to: like asyncio.gather(return_exceptions=True), the
+    exception is returned in that image's slot and the other results are kept.
 
-    prompt = """Analyze this clothing item image and provide detailed information about it.
+    Args:
+        image_paths (list): Paths to the clothing item images
 
-    Please provide the following information in JSON format:
-    {
-        "description": "A detailed description of the clothing item",
-        "tags": ["list", "of", "relevant", "tags", "about", "characteristics"],
-        "clothing_type": "type of clothing (e.g., shirt, pants, dress, hat, etc.)",
-        "color": "primary color of the item",
-        "texture": "texture description (e.g., smooth, rough, knitted, woven)",
-        "material": "material type (e.g., cotton, wool, denim, leather)",
-        "style": "style description (e.g., casual, formal, vintage, modern)",
-        "season": "suitable season (e.g., summer, winter, all-season)"
-    }
+    Returns:
+        list: ClothingAnalysis (or the exception that stopped it) for each image, in the same order as image_paths
+    """
+    if not image_paths:
+        return []
 
-    Focus on visible characteristics and provide specific, descriptive tags that would be useful for fashion categorization and search."""
+    results = [None] * len(image_paths)
+
+    # Cache lookups use the raw file bytes, so only misses pay for downscaling
+    with ThreadPoolExecutor(max_workers=min(MAX_LOAD_WORKERS, len(image_paths))) as executor:
+        reads = [executor.submit(_read_image_file, path) for path in image_paths]
+
+        fits = []
+        for index, (path, read) in enumerate(zip(image_paths, reads)):
+            try:
+                image_bytes, mime_type = read.result()
+            except (OSError, ValueError) as e:
+                results[index] = e
+                continue
+            cache_key = _analysis_cache_key(image_bytes)
+            results[index] = _get_cached_analysis(cache_key)
+            if results[index] is None:
+                fits.append((index, cache_key, executor.submit(_fit_image_for_request, image_bytes, mime_type, path)))
+
+        misses = []
+        for index, cache_key, fit in fits:
+            try:
+                image_bytes, mime_type = fit.result()
+            except ValueError as e:
+                results[index] = e
+                continue
+            misses.append((index, cache_key, image_bytes, mime_type))
+
+    # Group misses into requests that stay under the per-request image budget
+    batches = []
+    batch, batch_bytes = [], 0
+    for miss in misses:
+        size = len(miss[2])
+        if batch and (len(batch) == ANALYSIS_BATCH_SIZE or batch_bytes + size > MAX_REQUEST_IMAGE_BYTES):
+            batches.append(batch)
+            batch, batch_bytes = [], 0
+        batch.append(miss)
+        batch_bytes += size
+    if batch:
+        batches.append(batch)
+
+    if batches:
+        with ThreadPoolExecutor(max_workers=min(MAX_ANALYSIS_WORKERS, len(batches))) as executor:
+            for batch, batch_results in zip(batches, executor.map(_analyze_batch, batches)):
+                for (index, _, _, _), result in zip(batch, batch_results):
+                    results[index] = result
+
+    return results
+
+def _analyze_batch(batch):
+    """
+    Analyze a batch of (index, cache_key, image_bytes, mime_type) downscaled misses in one request.
 
-    model = "gemini-2.5-flash"
+    Falls back to one request per image when the batched call fails or its
+    answers can't be matched to the images; per-image failures are returned
+    in place of that image's analysis.
+    """
+    if len(batch) > 1:
+        try:
+            analyses = _request_batch_analysis(batch)
+        except ANALYSIS_REQUEST_ERRORS as e:
+            logger.warning("Batched analysis failed (%s); analyzing individually", e)
+            analyses = None
+
+        if analyses is not None and len(analyses) == len(batch):
+            for (_, cache_key, _, _), analysis in zip(batch, analyses):
+                _cache_analysis(cache_key, analysis)
+            return analyses
+        if analyses is not None:
+            # Can't tell which answer belongs to which image; ask about each one separately
+            logger.warning("Batched analysis did not return one result per image; analyzing individually")
+
+    results = []
+    for _, cache_key, image_bytes, mime_type in batch:
+        try:
+            results.append(_analyze_prepared_image(cache_key, image_bytes, mime_type))
+        except ANALYSIS_REQUEST_ERRORS as e:
+            results.append(e)
+    return results
+
+def _request_batch_analysis(batch):
+    """Send a batch of downscaled images in one request and return the parsed list, or None."""
+    # Number the images so the model can keep its answers in order
+    contents = [BATCH_ANALYSIS_PROMPT]
+    for number, (_, _, image_bytes, mime_type) in enumerate(batch, 1):
+        contents.append(f"Image {number}:")
+        contents.append(_bytes_to_part(image_bytes, mime_type))
 
-    response = client.models.generate_content(
-        model=model,
-        contents=[prompt, image],
+    generate_content_config = types.GenerateContentConfig(
+        response_mime_type="application/json",
+        response_schema=list[ClothingAnalysis],
     )
 
-    try:
-        # Parse the JSON response
-        response_text = response.text.strip()
-        # Remove markdown code blocks if present
-        if response_text.startswith("```json"):
-            response_text = response_text[7:]
-        if response_text.endswith("```"):
-            response_text = response_text[:-3]
-
-        analysis_data = json.loads(response_text.strip())
-        return ClothingAnalysis(**analysis_data)
-    except (json.JSONDecodeError, Exception) as e:
-        print(f"Error parsing response: {e}")
-        print(f"Raw response: {response.text}")
-        # Return a fallback analysis
-        return ClothingAnalysis(
-            description="Unable to analyze clothing item",
-            tags=["unknown"],
-            clothing_type="unknown",
-            color="unknown",
-            texture="unknown",
-            material="unknown",
-            style="unknown",
-            season="unknown"
-        )
+    response = _generate_content(
+        model=ANALYSIS_MODEL,
+        contents=contents,
+        config=generate_content_config,
+    )
+    return response.parsed
 
-def generate_fashion_product_images(apparel_image_paths, model_image_path, output_prefix="product"):
+def analyze_clothing_item_bytes(image_bytes, mime_type):
     """
-    Generate fashion product listing images showing a model wearing multiple apparel items from 4 different angles.
+    Analyze clothing item image bytes that are already in memory.
 
     Args:
-        apparel_image_paths (list): List of paths to apparel item images (clothing, accessories, etc.)
-        model_image_path (str): Path to the model image
-        output_prefix (str): Prefix for output image files
+        image_bytes (bytes): Raw image data
+        mime_type (str): MIME type of the image data
+
+    Returns:
+        ClothingAnalysis: Structured analysis of the clothing item
     """
-    client = genai.Client(
-        api_key=os.environ.get("GEMINI_API_KEY"),
+    # Identical images (retries, re-runs) are answered from the cache
+    cache_key = _analysis_cache_key(image_bytes)
+    cached = _get_cached_analysis(cache_key)
+    if cached is not None:
+        return cached
+
+    image_bytes, mime_type = _fit_image_for_request(image_bytes, mime_type)
+    return _analyze_prepared_image(cache_key, image_bytes, mime_type)
+
+def _analyze_prepared_image(cache_key, image_bytes, mime_type):
+    """Send one downscaled image for analysis and cache the result under cache_key."""
+    image = _bytes_to_part(image_bytes, mime_type)
+
+    # Have the SDK enforce the schema and hand back a validated model
+    generate_content_config = types.GenerateContentConfig(
+        response_mime_type="application/json",
+        response_schema=ClothingAnalysis,
     )
 
-    # Load images
-    # Load all apparel images
-    apparel_parts = []
-    for apparel_path in apparel_image_paths:
-        apparel_bytes, apparel_mime = load_image_as_bytes(apparel_path)
-        apparel_parts.append(types.Part.from_bytes(
-            data=apparel_bytes,
-            mime_type=apparel_mime
-        ))
+    response = _generate_content(
+        model=ANALYSIS_MODEL,
+        contents=[ANALYSIS_PROMPT, image],
+        config=generate_content_config,
+    )
 
-    # Load model image
-    model_bytes, model_mime = load_image_as_bytes(model_image_path)
+    # parsed is None when the output didn't validate against the schema
+    analysis = response.parsed
+    if analysis is not None:
+        _cache_analysis(cache_key, analysis)
+        return analysis
 
-    model = "gemini-2.5-flash-image-preview"
+    logger.warning("Analysis response did not match the ClothingAnalysis schema: %s", response.text)
+    # Return a fallback analysis
+    return _UNKNOWN_ANALYSIS
 
-    prompt = """Using the provided images, place [apparel items from the apparel images] onto [model from the model image].
-    Ensure that the features of [model from the model image] remain completely unchanged. The added [apparel items] should integrate naturally and realistically, with proper layering and positioning appropriate for each type of item (clothing, accessories, shoes, etc.).
+def generate_fashion_product_images(apparel_image_paths, model_image_path, output_prefix="product", output_dir=None):
+    """
+    Generate fashion product listing images showing a model wearing multiple apparel items from 4 different angles.
 
-    Generate a single composite image that shows the model wearing the clothing from 4 different angles:
-    1. Front view - model facing forward
-    2. Back view - model facing away
-    3. Side view (left profile)
-    4. Side view (right profile)
+    Args:
+        apparel_image_paths (list): List of paths to apparel item images (clothing, accessories, etc.)
+        model_image_path (str): Path to the model image
+        output_prefix (str): Prefix for output image files
+        output_dir (str): Directory the images are written to (defaults to the current directory)
 
-    Arrange these 4 views in a clean, professional grid layout suitable for an e-commerce product listing.
-    The background should be clean and neutral (white or light gray).
-    Ensure the clothing fits naturally on the model and maintain consistent lighting across all angles.
-    The style should be professional fashion photography suitable for online retail.
+    Returns:
+        tuple: (list of saved image file paths, list of text parts the model returned)
+    """
+    # Load all apparel images and the model image concurrently; the model image comes last
+    image_paths = [*apparel_image_paths, model_image_path]
+    with ThreadPoolExecutor(max_workers=min(MAX_LOAD_WORKERS, len(image_paths))) as executor:
+        loaded_images = list(executor.map(load_image_as_bytes, image_paths))
 
-    Important: Only follow the exact appearance and characteristics shown in the provided images - do not add any additional features or modifications."""
+    # Send each distinct apparel image once, even if it appears under several paths
+    model_bytes, model_mime = loaded_images[-1]
+    apparel_parts = []
+    seen_digests = set()
+    request_bytes = len(model_bytes)
+    for data, mime in loaded_images[:-1]:
+        digest = hashlib.sha256(data).digest()
+        if digest in seen_digests:
+            continue
+        seen_digests.add(digest)
+        request_bytes += len(data)
+        apparel_parts.append(_bytes_to_part(data, mime))
+
+    if request_bytes > MAX_REQUEST_IMAGE_BYTES:
+        raise ValueError(
+            f"Images too large for one request ({request_bytes} bytes, max {MAX_REQUEST_IMAGE_BYTES}); "
+            "use fewer or smaller apparel images"
+        )
 
     # Build contents array with prompt, all apparel images, and model image
-    contents = [prompt]
+    contents = [PRODUCT_SHOOT_PROMPT]
     contents.extend(apparel_parts)  # Add all apparel image parts
-    contents.append(types.Part.from_bytes(  # Add model image
-        data=model_bytes,
-        mime_type=model_mime
-    ))
+    contents.append(_bytes_to_part(model_bytes, model_mime))  # Add model image
 
     generate_content_config = types.GenerateContentConfig(
         response_modalities=[
@@ -166,69 +554,89 @@ def generate_fashion_product_images(apparel_image_paths, model_image_path, outpu
         ],
     )
 
-    print("Generating fashion product images...")
+    if output_dir is not None:
+        os.makedirs(output_dir, exist_ok=True)
+
+    logger.debug("Generating fashion product images...")
     file_index = 0
+    saved_paths = []
+    model_texts = []
 
-    for chunk in client.models.generate_content_stream(
-        model=model,
-        contents=contents,
-        config=generate_content_config,
-    ):
-        if (
-            chunk.candidates is None
-            or chunk.candidates[0].content is None
-            or chunk.candidates[0].content.parts is None
-        ):
-            continue
+    # Hand finished images to a writer thread so disk writes don't stall the stream
+    write_queue = queue.Queue()
+    write_errors = []
+    writer = threading.Thread(target=_write_queued_files, args=(write_queue, write_errors), daemon=True)
+    writer.start()
 
-        for part in chunk.candidates[0].content.parts:
-            if part.inline_data and part.inline_data.data:
-                file_name = f"{output_prefix}_{file_index}"
-                file_index += 1
-                inline_data = part.inline_data
-                data_buffer = inline_data.data
-                file_extension = mimetypes.guess_extension(inline_data.mime_type)
-                if file_extension is None:
-                    file_extension = ".png"
-                save_binary_file(f"{file_name}{file_extension}", data_buffer)
-            elif part.text:
-                print(part.text)
+    try:
+        for chunk in _open_content_stream(
+            model=GENERATION_MODEL,
+            contents=contents,
+            config=generate_content_config,
+        ):
+            if (
+                chunk.candidates is None
+                or chunk.candidates[0].content is None
+                or chunk.candidates[0].content.parts is None
+            ):
+                continue
+
+            for part in chunk.candidates[0].content.parts:
+                if part.inline_data and part.inline_data.data:
+                    file_name = f"{output_prefix}_{file_index}"
+                    if output_dir is not None:
+                        file_name = os.path.join(output_dir, file_name)
+                    file_index += 1
+                    inline_data = part.inline_data
+                    data_buffer = inline_data.data
+                    file_extension = MIME_TO_EXTENSION.get(inline_data.mime_type, ".png")
+                    file_path = f"{file_name}{file_extension}"
+                    write_queue.put((file_path, data_buffer))
+                    saved_paths.append(file_path)
+                elif part.text:
+                    model_texts.append(part.text)
+    finally:
+        # Let pending writes finish even if the stream failed
+        write_queue.put(None)
+        writer.join()
+
+    if write_errors:
+        raise write_errors[0]
+
+    return saved_paths, model_texts
 
 # FOR MODEL
 def get_first_image_in_folder(folder_path):
     """Get the first image file found in the specified folder."""
-    if not os.path.exists(folder_path):
-        return None
-
-    image_extensions = {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp'}
-
-    for filename in os.listdir(folder_path):
-        if any(filename.lower().endswith(ext) for ext in image_extensions):
-            return os.path.join(folder_path, filename)
+    try:
+        with os.scandir(folder_path) as entries:
+            for entry in entries:
+                if entry.is_file() and os.path.splitext(entry.name)[1].lower() in IMAGE_EXTENSIONS:
+                    return os.path.join(folder_path, entry.name)
+    except FileNotFoundError:
+        pass
 
     return None
 
 # FOR APPARELS
 def get_all_images_in_folder(folder_path):
     """Get all image files found in the specified folder."""
-    if not os.path.exists(folder_path):
+    try:
+        with os.scandir(folder_path) as entries:
+            image_files = [
+                os.path.join(folder_path, entry.name)
+                for entry in entries
+                if entry.is_file() and os.path.splitext(entry.name)[1].lower() in IMAGE_EXTENSIONS
+            ]
+    except FileNotFoundError:
         return []
 
-    image_extensions = {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp'}
-    image_files = []
-
-    for filename in os.listdir(folder_path):
-        if any(filename.lower().endswith(ext) for ext in image_extensions):
-            image_files.append(os.path.join(folder_path, filename))
-
     return sorted(image_files)  # Sort for consistent ordering
 
 
 def main():
-    # Define folder paths relative to the script location
-    script_dir = os.path.dirname(os.path.abspath(__file__))
-    apparels_folder = os.path.join(script_dir, "apparels")
-    model_folder = os.path.join(script_dir, "model")
+    apparels_folder = APPARELS_DIR
+    model_folder = MODEL_DIR
 
     # Get all apparel images from the apparels folder
     apparel_paths = get_all_images_in_folder(apparels_folder)
@@ -247,41 +655,72 @@ def main():
         print(f"Place image files in the '{apparels_folder}' folder.")
         return
 
-    # Step 1: Analyze the apparel items (always do this first)
+    # Generation only needs the image paths, not the analyses, so start it
+    # right away and let it run while the apparel items are analyzed
+    generation = None
+    if model_path:
+        print("Product image generation started; it runs while the apparel items are analyzed.")
+        executor = ThreadPoolExecutor(max_workers=1)
+        generation = executor.submit(generate_fashion_product_images, apparel_paths, model_path, "product", output_dir=SCRIPT_DIR)
+        executor.shutdown(wait=False)
+
+    # Step 1: Analyze the apparel items
     print("STEP 1: ANALYZING APPAREL ITEMS")
 
-    apparel_analyses = []
-    for i, apparel_path in enumerate(apparel_paths, 1):
-        print(f"\nAnalyzing apparel item {i}: {apparel_path}")
-        try:
-            apparel_analysis = analyze_clothing_item(apparel_path)
-            apparel_analyses.append(apparel_analysis)
-            print(f"\n🔍 APPAREL ITEM {i} ANALYSIS RESULTS:")
-            print("-" * 40)
-            print(f"📝 Description: {apparel_analysis.description}")
-            print(f"🏷️  Type: {apparel_analysis.clothing_type}")
-            print(f"🎨 Color: {apparel_analysis.color}")
-            print(f"🧵 Material: {apparel_analysis.material}")
-            print(f"✨ Texture: {apparel_analysis.texture}")
-            print(f"👔 Style: {apparel_analysis.style}")
-            print(f"🌤️  Season: {apparel_analysis.season}")
-            print(f"🏷️  Tags: {', '.join(apparel_analysis.tags)}")
-            print("-" * 40)
-        except Exception as e:
-            print(f"Error analyzing apparel item {i}: {e}")
-            return
-
-    # Step 2: Generate product images
-    if not model_path or not os.path.exists(model_path):
+    print(f"\nAnalyzing {len(apparel_paths)} apparel item(s)...")
+
+    try:
+        apparel_results = analyze_clothing_items(apparel_paths)
+    except Exception as e:
+        # Generation is already under way, so still collect its results below
+        print(f"Error analyzing apparel items: {e}")
+        apparel_results = []
+
+    # Build the whole report first and write it to stdout in one go;
+    # items that failed are reported without hiding the ones that succeeded
+    report = []
+    for i, (apparel_path, apparel_analysis) in enumerate(zip(apparel_paths, apparel_results), 1):
+        if isinstance(apparel_analysis, Exception):
+            report.append(f"\nError analyzing apparel item {i} ({apparel_path}): {apparel_analysis}")
+            continue
+        report.extend([
+            f"\n🔍 APPAREL ITEM {i} ANALYSIS RESULTS:",
+            "-" * 40,
+            f"📝 Description: {apparel_analysis.description}",
+            f"🏷️  Type: {apparel_analysis.clothing_type}",
+            f"🎨 Color: {apparel_analysis.color}",
+            f"🧵 Material: {apparel_analysis.material}",
+            f"✨ Texture: {apparel_analysis.texture}",
+            f"👔 Style: {apparel_analysis.style}",
+            f"🌤️  Season: {apparel_analysis.season}",
+            f"🏷️  Tags: {', '.join(apparel_analysis.tags)}",
+            "-" * 40,
+        ])
+    print("\n".join(report))
+
+    # Step 2: Collect the generated product images
+    if generation is None:
         print("Error: No model image found for product generation.")
         print(f"Place an image file in the '{model_folder}' folder.")
         return
 
     print("\n" + "=" * 60)
-    print("STEP 2: GENERATING PRODUCT IMAGES")
+    print("STEP 2: COLLECTING GENERATED PRODUCT IMAGES")
     print("=" * 60)
 
-    generate_fashion_product_images(apparel_paths, model_path, "product")
+    try:
+        saved_paths, model_texts = generation.result()
+    except Exception as e:
+        print(f"Error generating product images: {e}")
+        return
+
+    # The model explains refusals and partial results in its text parts
+    for text in model_texts:
+        print(text)
+    if not saved_paths:
+        print("No images were generated.")
+    for path in saved_paths:
+        print(f"File saved to: {path}")
 
 
 if __name__ == "__main__":